@@ -0,0 +1,105 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# Cython build of the CPU batch kernel from program.py (step/run_n), used when Numba
+# is not installed. Same arguments and semantics: the NumPy register file, host-order
+# uint32 word views of RAM and ROM, and the Memory._fetch_pages flags.
+#
+# Build in place with:  python setup.py build_ext --inplace
+
+import sys
+
+from libc.stdint cimport int32_t, int64_t, uint8_t, uint32_t
+
+# Byte swap intrinsic and the instruction field constants (kept in sync with program.py),
+# defined as C macros so they compile to immediates.
+cdef extern from *:
+    """
+    #if defined(_MSC_VER)
+    #include <stdlib.h>
+    #define core_bswap32(x) _byteswap_ulong(x)
+    #else
+    #define core_bswap32(x) __builtin_bswap32(x)
+    #endif
+    #define CORE_OP_SHIFT 26
+    #define CORE_RS_SHIFT 21
+    #define CORE_RT_SHIFT 16
+    #define CORE_OP_MASK 0x3Fu
+    #define CORE_REG_MASK 0x1Fu
+    #define CORE_IMM16_MASK 0xFFFFu
+    #define CORE_TARGET_MASK 0x03FFFFFFu
+    #define CORE_PC_UPPER_MASK 0xF0000000u
+    #define CORE_CART_BASE 0x10000000
+    """
+    uint32_t core_bswap32(uint32_t x) nogil
+    const int OP_SHIFT "CORE_OP_SHIFT"
+    const int RS_SHIFT "CORE_RS_SHIFT"
+    const int RT_SHIFT "CORE_RT_SHIFT"
+    const uint32_t OP_MASK "CORE_OP_MASK"
+    const uint32_t REG_MASK "CORE_REG_MASK"
+    const uint32_t IMM16_MASK "CORE_IMM16_MASK"
+    const uint32_t TARGET_MASK "CORE_TARGET_MASK"
+    const uint32_t PC_UPPER_MASK "CORE_PC_UPPER_MASK"
+    const int64_t CART_BASE "CORE_CART_BASE"
+
+# Checked by program.py against its own KERNEL_ABI so a build left over from an older
+# run_n signature is ignored instead of called; bump both together.
+KERNEL_ABI = 2
+
+cdef bint _host_little_endian = sys.byteorder == 'little'
+
+cdef inline uint32_t _fetch32(const uint32_t[::1] ram, const uint32_t[::1] rom, int64_t address) noexcept nogil:
+    # Same RDRAM/ROM decoding as Memory.read32. Only called for pages run_n has checked
+    # against Memory._fetch_pages, so I/O and partial pages never reach it.
+    cdef uint32_t word
+    cdef int64_t off
+    if 0x80000000LL <= address < 0xC0000000LL:
+        address &= 0x1FFFFFFF  # KSEG0/KSEG1 mirrors of physical memory
+    if address < ram.shape[0] * 4:
+        word = ram[address >> 2]
+    else:
+        off = address - CART_BASE
+        if off < 0 or off >= rom.shape[0] * 4:
+            return 0  # unmapped
+        word = rom[off >> 2]
+    if _host_little_endian:
+        return core_bswap32(word)
+    return word
+
+cdef inline int64_t _step(uint32_t[::1] regs, const uint32_t[::1] ram, const uint32_t[::1] rom, int64_t pc) noexcept nogil:
+    cdef uint32_t instr = _fetch32(ram, rom, pc)
+    cdef unsigned int opcode = (instr >> OP_SHIFT) & OP_MASK
+    cdef unsigned int rs = (instr >> RS_SHIFT) & REG_MASK
+    cdef unsigned int rt = (instr >> RT_SHIFT) & REG_MASK
+    cdef uint32_t imm = instr & IMM16_MASK
+    cdef int64_t simm = <int64_t>(imm ^ 0x8000) - 0x8000  # branch-free sign extension (sx16)
+    pc += 4
+    # Compiles to a C switch on opcode.
+    if opcode == 2 or opcode == 3:
+        # J-type (jump) instructions
+        pc = (pc & PC_UPPER_MASK) | ((instr & TARGET_MASK) << 2)
+    elif opcode == 8 or opcode == 9:  # ADDI/ADDIU
+        regs[rt] = <uint32_t>(regs[rs] + simm)
+    elif opcode == 10:  # SLTI
+        regs[rt] = <int32_t>regs[rs] < simm
+    elif opcode == 11:  # SLTIU
+        regs[rt] = regs[rs] < <uint32_t>simm
+    elif opcode == 12:  # ANDI
+        regs[rt] = regs[rs] & imm
+    elif opcode == 13:  # ORI
+        regs[rt] = regs[rs] | imm
+    elif opcode == 14:  # XORI
+        regs[rt] = regs[rs] ^ imm
+    elif opcode == 15:  # LUI
+        regs[rt] = imm << 16
+    regs[0] = 0  # r0 is hardwired to zero: store unconditionally instead of guarding writes
+    return pc
+
+def run_n(uint32_t[::1] regs, const uint32_t[::1] ram, const uint32_t[::1] rom,
+          const uint8_t[::1] pages, int64_t pc, Py_ssize_t n_cycles):
+    # Execute up to n_cycles instructions; returns (pc, executed), stopping early when pc
+    # leaves the pages flagged in pages so the caller can interpret that block.
+    cdef Py_ssize_t executed = 0
+    with nogil:
+        while executed < n_cycles and pages[pc >> 20]:
+            pc = _step(regs, ram, rom, pc) & 0xFFFFFFFFLL  # pc wraps at 32 bits
+            executed += 1
+    return pc, executed
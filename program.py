@@ -1,92 +1,483 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+
+import numpy as np
+
+try:
+    from numba import njit
+    _HAVE_NUMBA = True
+except ImportError:
+    _HAVE_NUMBA = False
+    def njit(*args, **kwargs):
+        # Stand-in decorator: the kernels below still run, just as plain Python.
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+_HOST_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+# MIPS instruction field layout. Module-level constants are frozen into the compiled
+# kernels as immediates and keep the interpreter's decode readable.
+OP_SHIFT = 26
+RS_SHIFT = 21
+RT_SHIFT = 16
+RD_SHIFT = 11
+OP_MASK = 0x3F          # primary opcode (after OP_SHIFT)
+FUNC_MASK = 0x3F        # SPECIAL function field
+REG_MASK = 0x1F         # register number fields
+IMM16_MASK = 0xFFFF     # I-type immediate
+TARGET_MASK = 0x03FFFFFF  # J-type jump target
+PC_UPPER_MASK = 0xF0000000  # pc bits kept by J/JAL
+
+# Instructions executed per slice of the main loop before peripherals are serviced.
+# Peripherals only need servicing at video/audio rates, so one slice is roughly one
+# NTSC scanline of VR4300 time (93.75 MHz / (60 frames * 525 lines)).
+CPU_CLOCK_HZ = 93_750_000
+STEPS_PER_BATCH = CPU_CLOCK_HZ // (60 * 525)
+
+# --- Compiled CPU kernels ---
+# These operate directly on the NumPy register file and native-order word views
+# of RAM/ROM (Numba cannot index non-native '>u4' arrays), so a whole batch of
+# instructions runs without returning to the interpreter.
+
+@njit(cache=True)
+def _bswap32(x):
+    return (((x & 0xFF) << 24) | (((x >> 8) & 0xFF) << 16)
+            | (((x >> 16) & 0xFF) << 8) | ((x >> 24) & 0xFF))
+
+@njit(cache=True)
+def _fetch32(ram, rom, address):
+    # Same RDRAM/ROM decoding as Memory.read32. Only called for pages run_n has checked
+    # against Memory._fetch_pages, so I/O and partial pages never reach it.
+    if 0x80000000 <= address < 0xC0000000:
+        address &= 0x1FFFFFFF  # KSEG0/KSEG1 mirrors of physical memory
+    if address < ram.size * 4:
+        word = np.int64(ram[address >> 2])
+    else:
+        off = address - 0x10000000
+        if off < 0 or off >= rom.size * 4:
+            return np.int64(0)  # unmapped
+        word = np.int64(rom[off >> 2])
+    if _HOST_LITTLE_ENDIAN:
+        return _bswap32(word)
+    return word
+
+@njit(cache=True)
+def step(regs, ram, rom, pc):
+    # Execute one instruction (the compiled counterpart of one instruction of the
+    # interpreter's block loop in VR4300CPU._interpret); returns the new pc.
+    instr = _fetch32(ram, rom, pc)
+    pc += 4
+    opcode = (instr >> OP_SHIFT) & OP_MASK
+    rs = (instr >> RS_SHIFT) & REG_MASK
+    rt = (instr >> RT_SHIFT) & REG_MASK
+    imm = instr & IMM16_MASK
+    simm = (imm ^ 0x8000) - 0x8000  # branch-free sign extension (sx16)
+    if opcode == 0:  # SPECIAL opcode group
+        pass
+    elif opcode == 2 or opcode == 3:
+        # J-type (jump) instructions
+        pc = (pc & PC_UPPER_MASK) | ((instr & TARGET_MASK) << 2)
+    elif opcode == 8 or opcode == 9:  # ADDI/ADDIU
+        regs[rt] = (np.int64(regs[rs]) + simm) & 0xFFFFFFFF
+    elif opcode == 10:  # SLTI
+        regs[rt] = (np.int64(regs[rs]) ^ 0x80000000) - 0x80000000 < simm
+    elif opcode == 11:  # SLTIU
+        regs[rt] = np.int64(regs[rs]) < (simm & 0xFFFFFFFF)
+    elif opcode == 12:  # ANDI
+        regs[rt] = np.int64(regs[rs]) & imm
+    elif opcode == 13:  # ORI
+        regs[rt] = np.int64(regs[rs]) | imm
+    elif opcode == 14:  # XORI
+        regs[rt] = np.int64(regs[rs]) ^ imm
+    elif opcode == 15:  # LUI
+        regs[rt] = imm << 16
+    regs[0] = 0  # r0 is hardwired to zero: store unconditionally instead of guarding writes
+    return pc
+
+@njit(cache=True)
+def run_n(regs, ram, rom, pages, pc, n_cycles):
+    # Execute up to n_cycles instructions; returns (pc, executed). Stops early when pc
+    # leaves the whole RDRAM/ROM pages flagged in pages (Memory._fetch_pages) so the
+    # caller can hand that code to the interpreter.
+    executed = 0
+    while executed < n_cycles and pages[pc >> 20]:
+        pc = step(regs, ram, rom, pc) & 0xFFFFFFFF  # pc wraps at 32 bits
+        executed += 1
+    return pc, executed
+
+# Without Numba, fall back to the Cython build of the same kernel (_vr4300_kernel.pyx,
+# built by setup.py) if it has been compiled; otherwise the interpreter path is used.
+# A build whose KERNEL_ABI differs predates the current run_n signature and is skipped.
+KERNEL_ABI = 2
+_HAVE_COMPILED_KERNEL = _HAVE_NUMBA
+if not _HAVE_NUMBA:
+    try:
+        import _vr4300_kernel
+    except ImportError:
+        pass
+    else:
+        if getattr(_vr4300_kernel, 'KERNEL_ABI', None) == KERNEL_ABI:
+            run_n = _vr4300_kernel.run_n
+            _HAVE_COMPILED_KERNEL = True
+
 # --- Emulator Core (Backend) Classes ---
 
+_U32_BE = struct.Struct('>I')  # big-endian 32-bit word
+
+# Address map: 1 MB pages over the 32-bit space. KSEG0 (cached) and KSEG1 (uncached)
+# are unmapped windows onto the low 512 MB of physical memory.
+MEM_PAGE_SHIFT = 20
+MEM_PAGE_SIZE = 1 << MEM_PAGE_SHIFT
+MEM_PAGE_COUNT = 1 << (32 - MEM_PAGE_SHIFT)
+KSEG0_BASE = 0x80000000
+KSEG1_BASE = 0xA0000000
+CART_BASE = 0x10000000  # cartridge ROM domain
+CART_SIZE = 0x0FC00000
+
+def _physical(address: int) -> int:
+    # Strip the KSEG0/KSEG1 segment bits; other addresses are used as-is.
+    if KSEG0_BASE <= address < 0xC0000000:
+        return address & 0x1FFFFFFF
+    return address
+
 # Memory class to handle RDRAM and memory-mapped IO
 class Memory:
     def __init__(self, size_bytes):
         self.ram = bytearray(size_bytes)  # main RDRAM
-        # We could map additional regions (ROM, IO) here as needed.
-    def load_cartridge(self, rom_data: bytes):
-        # Load ROM data into the cartridge memory region.
-        # For simplicity, assume direct mapping after RDRAM.
+        # Big-endian 32-bit word view aliasing the same buffer (no copy).
+        self._ram_u32 = np.frombuffer(self.ram, dtype='>u4')
+        self._ram_words = self._ram_u32.view(np.uint32)  # host-order view for the compiled kernels
+        self._ram_size = size_bytes
+        self.rom = b''
+        self._rom_u32 = np.zeros(0, dtype='>u4')
+        self._rom_words = self._rom_u32.view(np.uint32)
+        self._rom_size = 0
+        # Pages holding decoded CPU code; writes to them call on_code_write(page).
+        self.code_pages = set()
+        self.on_code_write = None
+        # Page tables over the 32-bit address space (1 MB pages). A read entry is
+        # (buffer, base) so the word lives at offset address - base in buffer; a write
+        # entry is just the base (RDRAM is the only fast writable region). None falls
+        # through to the slow path, which handles I/O and the partial last page of RDRAM
+        # or ROM when their sizes are not a whole number of pages.
+        self._read_pages = [None] * MEM_PAGE_COUNT
+        self._write_pages = [None] * MEM_PAGE_COUNT
+        self._io_pages = {}  # physical page -> (read_fn, write_fn)
+        # 1 for pages the compiled kernels may fetch from (the fast-path read pages).
+        self._fetch_pages = np.zeros(MEM_PAGE_COUNT, dtype=np.uint8)
+        for segment in (0, KSEG0_BASE, KSEG1_BASE):
+            for page in range(size_bytes >> MEM_PAGE_SHIFT):
+                self._read_pages[(segment >> MEM_PAGE_SHIFT) + page] = (self.ram, segment)
+                self._write_pages[(segment >> MEM_PAGE_SHIFT) + page] = segment
+        self._sync_fetch_pages()
+    def load_cartridge(self, rom_data):
+        # Load ROM data (bytes, mmap or '>u4' array) into the cartridge memory region.
         self.rom = rom_data
+        words = memoryview(rom_data).nbytes // 4
+        self._rom_u32 = np.frombuffer(rom_data, dtype='>u4', count=words)
+        self._rom_words = self._rom_u32.view(np.uint32)
+        self._rom_size = words * 4
+        # Map the cartridge domain (and its KSEG0/KSEG1 mirrors); a trailing partial
+        # page is left to the bounds-checked slow path.
+        first = CART_BASE >> MEM_PAGE_SHIFT
+        for segment in (0, KSEG0_BASE, KSEG1_BASE):
+            for page in range(first, first + (CART_SIZE >> MEM_PAGE_SHIFT)):
+                self._read_pages[(segment >> MEM_PAGE_SHIFT) + page] = None
+            for page in range(self._rom_size >> MEM_PAGE_SHIFT):
+                if page + first not in self._io_pages:  # I/O mapped over the ROM wins
+                    self._read_pages[((segment + CART_BASE) >> MEM_PAGE_SHIFT) + page] = (self._rom_u32, segment + CART_BASE)
+        self._sync_fetch_pages()
+    def map_io(self, start: int, end: int, read_fn, write_fn):
+        # Route physical pages [start, end) to I/O handlers called with the physical address.
+        # Any RDRAM/ROM fast-path entries for those pages (and their KSEG0/KSEG1 mirrors)
+        # are dropped so accesses reach the handlers through the slow path.
+        for page in range(start >> MEM_PAGE_SHIFT, (end + MEM_PAGE_SIZE - 1) >> MEM_PAGE_SHIFT):
+            self._io_pages[page] = (read_fn, write_fn)
+            mirrors = (0, KSEG0_BASE, KSEG1_BASE) if page < (0x20000000 >> MEM_PAGE_SHIFT) else (0,)
+            for segment in mirrors:
+                self._read_pages[(segment >> MEM_PAGE_SHIFT) + page] = None
+                self._write_pages[(segment >> MEM_PAGE_SHIFT) + page] = None
+        self._sync_fetch_pages()
+    def _sync_fetch_pages(self):
+        # Rebuild the kernels' page flags from the read page table after it changes.
+        self._fetch_pages[:] = [entry is not None for entry in self._read_pages]
     def read32(self, address: int) -> int:
         # Read 32-bit word from memory (handles RDRAM vs ROM vs I/O addresses).
-        # (In a real emulator, we'd have address decoding here)
-        if address < len(self.ram):
-            return int.from_bytes(self.ram[address:address+4], 'big')
-        else:
-            # If address falls in ROM range, compute offset and read from rom.
-            off = address - 0x10000000  # example offset for cartridge domain
-            return int.from_bytes(self.rom[off:off+4], 'big')
+        # Scalar reads go through a precompiled struct: cheaper than indexing the NumPy
+        # view and converting the resulting scalar back to int.
+        address &= 0xFFFFFFFC  # 32-bit address space, rounded down to the word like write32
+        entry = self._read_pages[address >> MEM_PAGE_SHIFT]
+        if entry is not None:
+            buf, base = entry
+            return _U32_BE.unpack_from(buf, address - base)[0]
+        return self._read_slow(_physical(address))
+    def _read_slow(self, phys: int) -> int:
+        io = self._io_pages.get(phys >> MEM_PAGE_SHIFT)
+        if io is not None:
+            return io[0](phys)
+        if phys < self._ram_size:
+            return _U32_BE.unpack_from(self.ram, phys)[0]  # tail of RDRAM
+        # Tail of a ROM whose size is not a whole number of pages
+        off = phys - CART_BASE
+        if 0 <= off < self._rom_size:
+            return _U32_BE.unpack_from(self._rom_u32, off)[0]
+        return 0  # unmapped
     def write32(self, address: int, value: int):
         # Write 32-bit word to memory (for RDRAM or I/O).
-        if address < len(self.ram):
-            self.ram[address:address+4] = value.to_bytes(4, 'big')
+        address &= 0xFFFFFFFC  # 32-bit address space, rounded down to the word
+        base = self._write_pages[address >> MEM_PAGE_SHIFT]
+        if base is not None:
+            phys = address - base
+            self._ram_u32[phys >> 2] = value & 0xFFFFFFFF
+            if phys >> CODE_PAGE_SHIFT in self.code_pages:
+                self.on_code_write(phys >> CODE_PAGE_SHIFT)
         else:
-            # For ROM or unmapped writes, ignore or handle appropriately.
-            pass
+            phys = _physical(address)
+            io = self._io_pages.get(phys >> MEM_PAGE_SHIFT)
+            if io is not None:
+                io[1](phys, value & 0xFFFFFFFF)
+            elif phys < self._ram_size:  # tail of RDRAM
+                self._ram_u32[phys >> 2] = value & 0xFFFFFFFF
+                if phys >> CODE_PAGE_SHIFT in self.code_pages:
+                    self.on_code_write(phys >> CODE_PAGE_SHIFT)
+            # ROM and unmapped writes are ignored.
     def reset(self):
-        self.ram[:] = b'\x00' * len(self.ram)  # clear RDRAM on reset
+        self._ram_u32.fill(0)  # clear RDRAM on reset (in place, no temporary)
+        if self.code_pages and self.on_code_write:
+            for page in list(self.code_pages):
+                self.on_code_write(page)
+
+# Basic blocks end at any instruction that can redirect control flow:
+# REGIMM/J/JAL/BEQ/BNE/BLEZ/BGTZ, COP0/1/2 (branches, ERET) and the branch-likely forms,
+# plus JR/JALR/SYSCALL/BREAK in the SPECIAL group.
+_BLOCK_END_OPCODES = frozenset({1, 2, 3, 4, 5, 6, 7, 16, 17, 18, 20, 21, 22, 23})
+_BLOCK_END_SPECIAL = frozenset({8, 9, 12, 13})
+MAX_BLOCK_INSTRUCTIONS = 256
+CODE_PAGE_SHIFT = 12  # 4 KB pages for code invalidation tracking
+
+def _ends_block(instr: int) -> bool:
+    opcode = (instr >> OP_SHIFT) & OP_MASK
+    if opcode == 0:
+        return (instr & FUNC_MASK) in _BLOCK_END_SPECIAL
+    return opcode in _BLOCK_END_OPCODES
+
+# Branch-free sign extension: flip the sign bit, then subtract it back out.
+def sx16(x: int) -> int:
+    return (x ^ 0x8000) - 0x8000
+
+def sx32(x: int) -> int:
+    return (x ^ 0x80000000) - 0x80000000
+
+# Opcode handler bodies. Each one is generated into a standalone function
+# h_<name>(rs, rt, rd, imm) that receives the pre-decoded fields and closes over the
+# owning cpu and its register file, so no self.* lookups or bound-method calls
+# happen per instruction. Anything without an entry here is not emulated yet
+# (R-type, loads/stores, branches, ...).
+_HANDLER_SOURCES = {
+    "unimplemented": "pass",
+    "j": "cpu.pc = (cpu.pc & PC_UPPER_MASK) | (imm << 2)",  # J/JAL (no link or delay slot yet)
+    "addi": "regs[rt] = (int(regs[rs]) + sx16(imm)) & 0xFFFFFFFF",  # (overflow trap not modeled)
+    "addiu": "regs[rt] = (int(regs[rs]) + sx16(imm)) & 0xFFFFFFFF",
+    "slti": "regs[rt] = sx32(int(regs[rs])) < sx16(imm)",
+    "sltiu": "regs[rt] = int(regs[rs]) < (sx16(imm) & 0xFFFFFFFF)",
+    "andi": "regs[rt] = regs[rs] & imm",
+    "ori": "regs[rt] = regs[rs] | imm",
+    "xori": "regs[rt] = regs[rs] ^ imm",
+    "lui": "regs[rt] = imm << 16",
+}
+# Handlers whose only effect is writing regs[rt]; with rt == 0 they are architectural
+# no-ops, so the decoder swaps in "unimplemented" (a no-op) instead.
+_RT_WRITERS = frozenset({"addi", "addiu", "slti", "sltiu", "andi", "ori", "xori", "lui"})
+# Primary opcode -> handler name
+_OPCODE_HANDLERS = {2: "j", 3: "j", 8: "addi", 9: "addiu", 10: "slti", 11: "sltiu",
+                    12: "andi", 13: "ori", 14: "xori", 15: "lui"}
+
+def _build_handler_factory():
+    # Emit one factory whose nested functions are the handlers, compile it once, and
+    # return it; each CPU instance calls it to get handlers bound to its own state.
+    lines = ["def make_handlers(cpu, regs):"]
+    for name, body in _HANDLER_SOURCES.items():
+        lines.append(f"    def h_{name}(rs, rt, rd, imm):")
+        lines.append(f"        {body}")
+    lines.append("    return {" + ", ".join(f"{name!r}: h_{name}" for name in _HANDLER_SOURCES) + "}")
+    namespace = {}
+    exec(compile("\n".join(lines), "<vr4300-handlers>", "exec"),
+         {"sx16": sx16, "sx32": sx32, "PC_UPPER_MASK": PC_UPPER_MASK}, namespace)
+    return namespace["make_handlers"]
+
+_make_handlers = _build_handler_factory()
+
+# CP0 (system control coprocessor) register numbers
+CP0_INDEX = 0
+CP0_RANDOM = 1
+CP0_ENTRYLO0 = 2
+CP0_ENTRYLO1 = 3
+CP0_CONTEXT = 4
+CP0_PAGEMASK = 5
+CP0_WIRED = 6
+CP0_BADVADDR = 8
+CP0_COUNT = 9
+CP0_ENTRYHI = 10
+CP0_COMPARE = 11
+CP0_STATUS = 12
+CP0_CAUSE = 13
+CP0_EPC = 14
+CP0_PRID = 15
+CP0_CONFIG = 16
+CP0_LLADDR = 17
+CP0_WATCHLO = 18
+CP0_WATCHHI = 19
+CP0_XCONTEXT = 20
+CP0_PARITYERROR = 26
+CP0_CACHEERROR = 27
+CP0_TAGLO = 28
+CP0_TAGHI = 29
+CP0_ERROREPC = 30
 
 # CPU (VR4300) emulation class
 class VR4300CPU:
     def __init__(self, memory: Memory):
         self.mem = memory
-        self.regs = [0] * 32       # 32 general-purpose registers
+        self.regs = np.zeros(32, dtype=np.uint32)  # 32 general-purpose registers
         self.pc = 0                # program counter
-        self.cp0 = {}              # coprocessor0 registers (Status, Cause, etc.)
+        self.cp0 = np.zeros(32, dtype=np.uint32)  # coprocessor0 registers, indexed by CP0_* number
+        self.use_jit = _HAVE_COMPILED_KERNEL  # run batches through the compiled kernel when available
+        # Dispatch tables of generated handlers (closed over this CPU and its register file):
+        # one indexed by primary opcode, one by SPECIAL func. SPECIAL (opcode 0) itself is
+        # resolved through _special_table when a block is decoded.
+        handlers = _make_handlers(self, self.regs)
+        unimplemented = handlers["unimplemented"]
+        self._op_table = (None,) + tuple(handlers.get(_OPCODE_HANDLERS.get(op), unimplemented)
+                                         for op in range(1, 64))
+        self._special_table = (unimplemented,) * 64
+        self._nop = unimplemented
+        self._rt_writers = frozenset(handlers[name] for name in _RT_WRITERS)
+        # Decoded basic blocks keyed by start pc, and the block pcs living in each code page.
+        self._block_cache = {}
+        self._page_blocks = {}
+        memory.on_code_write = self._invalidate_page
     def reset(self):
-        self.regs = [0] * 32
+        self.regs.fill(0)
+        self.cp0.fill(0)
         self.pc = 0xA4000040  # start at PIF boot ROM or entry point
+        self.flush_block_cache()
         # Initialize CP0 registers (Status, Cause, etc.) as on real hardware.
-    def execute_next_instruction(self):
-        instr = self.mem.read32(self.pc)
-        self.pc += 4
-        self._execute(instr)
-    def _execute(self, instr: int):
-        opcode = (instr >> 26) & 0x3F
-        # Decode the MIPS opcode and execute. (This is greatly simplified)
-        if opcode == 0:  # SPECIAL opcode group
-            func = instr & 0x3F
-            # ... handle R-type MIPS instructions ...
-        elif opcode == 2 or opcode == 3:
-            # J-type (jump) instructions
-            target = instr & 0x03FFFFFF
-            self.pc = (self.pc & 0xF0000000) | (target << 2)
+    def run(self, cycles: int):
+        # Execute a batch of (at least) the given number of instructions.
+        # The compiled kernel only fetches from whole RDRAM/ROM pages; whenever it stops
+        # short, the interpreter runs the block at pc (I/O, partial pages) and the kernel resumes.
+        if not self.use_jit:
+            self._interpret(cycles)
+            return
+        mem = self.mem
+        executed = 0
+        while executed < cycles:
+            pc, n = run_n(self.regs, mem._ram_words, mem._rom_words, mem._fetch_pages, self.pc, cycles - executed)
+            self.pc = int(pc)
+            executed += n
+            if executed < cycles:
+                executed += self._interpret(1)
+    def step(self) -> int:
+        # Execute the single basic block at pc (decoding it on first visit) through the
+        # interpreter, e.g. for debugger single-stepping. Returns the instructions executed.
+        return self._interpret(1)
+    def _interpret(self, cycles: int) -> int:
+        # Interpreter path: execute whole decoded basic blocks until at least `cycles`
+        # instructions have run; returns how many did. This is the only block loop, so
+        # run() and step() share it (one call per batch, not per block).
+        get_block = self._block_cache.get
+        regs = self.regs
+        executed = 0
+        while executed < cycles:
+            self.pc &= 0xFFFFFFFF  # pc wraps at 32 bits (blocks never straddle the wrap)
+            block = get_block(self.pc)
+            if block is None:
+                block = self._decode_block(self.pc)
+            for handler, rs, rt, rd, imm in block:
+                self.pc += 4
+                handler(rs, rt, rd, imm)
+            # r0 is hardwired to zero: writes to it are dropped at decode time, and this single
+            # unconditional store backs that up instead of guarding each write.
+            regs[0] = 0
+            executed += len(block)
+            # Note: In a full implementation, each instruction would be handled,
+            # and would potentially interact with RSP, set interrupts, etc.
+        return executed
+    def _decode(self, instr: int):
+        # Decode one instruction into a (handler, rs, rt, rd, imm) tuple.
+        opcode = (instr >> OP_SHIFT) & OP_MASK
+        if opcode == 0:  # SPECIAL opcode group: dispatch on the function field
+            handler = self._special_table[instr & FUNC_MASK]
+        else:
+            handler = self._op_table[opcode]
+        if opcode == 2 or opcode == 3:
+            imm = instr & TARGET_MASK  # J-type carries a 26-bit target instead
         else:
-            # I-type instructions (loads, stores, branch, immediate ops)
-            rs = (instr >> 21) & 0x1F
-            rt = (instr >> 16) & 0x1F
-            imm = instr & 0xFFFF
-            # ... implement load/store, ALU ops, branch, etc. ...
-            pass
-        # Note: In a full implementation, each instruction would be handled,
-        # and would potentially interact with RSP, set interrupts, etc.
+            imm = instr & IMM16_MASK
+        rt = (instr >> RT_SHIFT) & REG_MASK
+        if rt == 0 and handler in self._rt_writers:
+            handler = self._nop  # write to r0: resolved once here, not per execution
+        return (handler, (instr >> RS_SHIFT) & REG_MASK, rt, (instr >> RD_SHIFT) & REG_MASK, imm)
+    def _decode_block(self, pc: int):
+        # Decode forward from pc up to and including the first branch/jump, stopping
+        # early at the code page boundary so each block lives in exactly one page.
+        # Tracked by physical page so writes through any KSEG mirror invalidate it.
+        page = _physical(pc) >> CODE_PAGE_SHIFT
+        block = []
+        addr = pc
+        while len(block) < MAX_BLOCK_INSTRUCTIONS:
+            instr = self.mem.read32(addr)
+            block.append(self._decode(instr))
+            addr += 4
+            if _ends_block(instr) or _physical(addr) >> CODE_PAGE_SHIFT != page:
+                break
+        self._block_cache[pc] = block
+        self._page_blocks.setdefault(page, []).append(pc)
+        self.mem.code_pages.add(page)
+        return block
+    def _invalidate_page(self, page: int):
+        # Called by Memory when a page holding decoded code is written.
+        for pc in self._page_blocks.pop(page, ()):
+            self._block_cache.pop(pc, None)
+        self.mem.code_pages.discard(page)
+    def flush_block_cache(self):
+        self._block_cache.clear()
+        self._page_blocks.clear()
+        self.mem.code_pages.clear()
     def get_state(self):
-        return {"regs": self.regs.copy(), "pc": self.pc, "cp0": self.cp0.copy()}
+        return {"regs": self.regs.tobytes(), "pc": self.pc, "cp0": self.cp0.tobytes()}
     def set_state(self, state):
-        self.regs = state["regs"][:]
+        self.regs[:] = np.frombuffer(state["regs"], dtype=np.uint32)
         self.pc = state["pc"]
-        self.cp0 = state.get("cp0", {}).copy()
+        cp0 = state.get("cp0")
+        if cp0:
+            self.cp0[:] = np.frombuffer(cp0, dtype=np.uint32)
+        else:
+            self.cp0.fill(0)
+        self.flush_block_cache()
 
 # RSP (Reality Signal Processor) emulation class
 class RSP:
     def __init__(self, memory: Memory):
         self.mem = memory
         # The RSP has its own 32 32-bit registers and 16 128-bit vector registers, etc.
-        self.regs = [0] * 32
+        self.regs = np.zeros(32, dtype=np.uint32)
         # For brevity, not modeling vector registers here.
     def reset(self):
-        self.regs = [0] * 32
+        self.regs.fill(0)
     def process_tasks(self):
         # Check if the CPU has signaled a list for the RSP to process (graphics or audio).
         # If so, fetch the task from memory and simulate executing the RSP microcode.
         # This would involve reading commands/data from memory and writing back results.
         pass
     def get_state(self):
-        return {"regs": self.regs.copy()}
+        return {"regs": self.regs.tobytes()}
     def set_state(self, state):
-        self.regs = state["regs"][:]
+        self.regs[:] = np.frombuffer(state["regs"], dtype=np.uint32)
 
 # RDP (Reality Display Processor) emulation class
 class RDP:
@@ -94,9 +485,10 @@ class RDP:
         self.mem = memory
         # Framebuffer or output buffer could be part of state
         self.framebuffer = bytearray(640*480*4)  # example RGBA buffer
+        self._fb_u32 = np.frombuffer(self.framebuffer, dtype=np.uint32)  # one word per pixel
     def reset(self):
-        # Clear or reinitialize the framebuffer and any internal RDP state.
-        self.framebuffer = bytearray(len(self.framebuffer))
+        # Clear the framebuffer in place (views held by the renderer stay valid) and any internal RDP state.
+        self._fb_u32.fill(0)
     def render_if_ready(self):
         # If the RSP/CPU has filled the command buffer with new RDP commands, process them.
         # For LLE: interpret RDP commands and rasterize into framebuffer.
@@ -105,54 +497,181 @@ class RDP:
     def get_state(self):
         # We may not need the whole framebuffer in state (could regenerate), but include if necessary.
         return {"framebuffer": bytes(self.framebuffer)}
+    def framebuffer_view(self) -> memoryview:
+        # Read-only, zero-copy access for presenters that only need to look at the pixels.
+        return memoryview(self.framebuffer).toreadonly()
     def set_state(self, state):
         fb = state.get("framebuffer")
         if fb:
             self.framebuffer[:] = fb
 
+# Audio output ring capacity in int16 samples (power of two so indices wrap with a mask)
+AUDIO_RING_SAMPLES = 1 << 16
+
 # Audio system emulation class
 class AudioSystem:
     def __init__(self, memory: Memory):
         self.mem = memory
-        self.audio_buffer = []  # could be a list of generated audio samples
+        # Preallocated ring of generated audio samples; _w/_r are free-running write/read
+        # counters, so the buffer can never grow and _w - _r is the number of queued samples.
+        self.audio_buffer = np.zeros(AUDIO_RING_SAMPLES, dtype=np.int16)
+        self._w = 0
+        self._r = 0
     def reset(self):
-        self.audio_buffer.clear()
+        self.audio_buffer.fill(0)
+        self._w = self._r = 0
+    def push_samples(self, samples: np.ndarray):
+        # Queue samples for output, overwriting the oldest ones if the ring overflows.
+        n = len(samples)
+        if n > AUDIO_RING_SAMPLES:
+            samples = samples[-AUDIO_RING_SAMPLES:]
+            self._w += n - AUDIO_RING_SAMPLES
+            n = AUDIO_RING_SAMPLES
+        start = self._w & (AUDIO_RING_SAMPLES - 1)
+        first = min(n, AUDIO_RING_SAMPLES - start)
+        self.audio_buffer[start:start + first] = samples[:first]
+        self.audio_buffer[:n - first] = samples[first:]
+        self._w += n
+        self._r = max(self._r, self._w - AUDIO_RING_SAMPLES)
+    def pop_samples(self, max_samples: int) -> np.ndarray:
+        # Dequeue up to max_samples queued samples (copied out of the ring).
+        n = min(max_samples, self._w - self._r)
+        start = self._r & (AUDIO_RING_SAMPLES - 1)
+        first = min(n, AUDIO_RING_SAMPLES - start)
+        out = np.concatenate((self.audio_buffer[start:start + first], self.audio_buffer[:n - first]))
+        self._r += n
+        return out
     def update_audio(self):
         # Simulate audio hardware: if the AI (Audio Interface) DMA has new data, process it.
-        # For example, read audio samples from RAM and send to output (or store in buffer).
+        # For example, read audio samples from RAM and send to output (or push_samples them).
         pass
     def get_state(self):
-        return {"audio_buffer": self.audio_buffer.copy()}
+        return {"audio_buffer": self.audio_buffer.tobytes(), "w": self._w, "r": self._r}
     def set_state(self, state):
-        self.audio_buffer = state.get("audio_buffer", []).copy()
+        buf = state.get("audio_buffer")
+        if buf:
+            self.audio_buffer[:] = np.frombuffer(buf, dtype=np.int16)
+            self._w = state["w"]
+            self._r = state["r"]
+        else:
+            self.reset()
 
 # Controller/Input management
 class Controller:
-    def __init__(self):
-        # state of buttons (A, B, etc.), analog stick position, etc.
-        self.buttons = 0
-        self.joystick_x = 0
-        self.joystick_y = 0
-        self.connected = True  # whether a controller is present
-        # could include rumble state, mempak data, etc.
+    # Thin view of one controller slot; the state lives in InputManager's per-field arrays.
+    def __init__(self, manager, index: int):
+        self._manager = manager
+        self._index = index
+    # state of buttons (A, B, etc.), analog stick position, etc.
+    @property
+    def buttons(self) -> int:
+        return int(self._manager.buttons[self._index])
+    @buttons.setter
+    def buttons(self, value: int):
+        self._manager.buttons[self._index] = value
+    @property
+    def joystick_x(self) -> int:
+        return int(self._manager.x[self._index])
+    @joystick_x.setter
+    def joystick_x(self, value: int):
+        self._manager.x[self._index] = value
+    @property
+    def joystick_y(self) -> int:
+        return int(self._manager.y[self._index])
+    @joystick_y.setter
+    def joystick_y(self, value: int):
+        self._manager.y[self._index] = value
+    @property
+    def connected(self) -> bool:
+        # whether a controller is present
+        return bool(self._manager.connected[self._index])
+    @connected.setter
+    def connected(self, value: bool):
+        self._manager.connected[self._index] = value
+    # could include rumble state, mempak data, etc.
     def get_state(self):
         return {"buttons": self.buttons, "x": self.joystick_x, "y": self.joystick_y}
 
 class InputManager:
     def __init__(self, num_controllers=4):
-        self.controllers = [Controller() for _ in range(num_controllers)]
+        # Structure-of-arrays: one small contiguous array per field, indexed by port.
+        self.buttons = np.zeros(num_controllers, dtype=np.uint32)
+        self.x = np.zeros(num_controllers, dtype=np.int16)
+        self.y = np.zeros(num_controllers, dtype=np.int16)
+        self.connected = np.ones(num_controllers, dtype=np.bool_)
+        self.controllers = [Controller(self, i) for i in range(num_controllers)]
     def poll_inputs(self):
         # Poll OS for input state and update controllers. (e.g., via SDL or window events)
+        # An input backend should write all ports at once into buttons/x/y rather than
+        # going through the per-controller views.
         # This is just a placeholder; actual implementation would interface with hardware.
         pass
     def get_state(self):
-        # Return all controllers' states for save state.
-        return [c.get_state() for c in self.controllers]
-    def set_state(self, state_list):
+        # Return all controllers' states for save state (one buffer per field).
+        return {"b": self.buttons.tobytes(), "x": self.x.tobytes(), "y": self.y.tobytes()}
+    def set_state(self, state):
         # Restore controllers' states (mainly for things like mempak contents or transient state).
         # Buttons/joystick positions don't need restoring.
         pass
 
+# First word of a cartridge image in each common dump byte order
+ROM_MAGIC_Z64 = b'\x80\x37\x12\x40'  # big-endian (native)
+ROM_MAGIC_V64 = b'\x37\x80\x40\x12'  # byte-swapped halfwords
+ROM_MAGIC_N64 = b'\x40\x12\x37\x80'  # little-endian words
+
+# Save state file header: magic, format version, then the byte lengths of the
+# pickled component state, RDRAM and framebuffer sections that follow it.
+STATE_MAGIC = b'N64S'
+STATE_VERSION = 1
+STATE_HEADER = struct.Struct('<4sHIII')
+
+def _readinto_exact(reader, view: memoryview):
+    # Fill view completely from a stream (readinto may return short reads).
+    pos = 0
+    while pos < len(view):
+        n = reader.readinto(view[pos:])
+        if not n:
+            raise ValueError("save state is truncated")
+        pos += n
+
+def _pin_current_thread(core=None):
+    # Best-effort: restrict the calling thread to a single host core. Returns the
+    # thread's previous affinity for _restore_thread_affinity (None if pinning is
+    # unsupported or failed). Defaults to the highest core the process may run on,
+    # which is usually the one least busy with the UI thread and interrupts.
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            previous = os.sched_getaffinity(0)  # pid 0 = calling thread on Linux
+            if core is None:
+                core = max(previous)
+            os.sched_setaffinity(0, {core})
+            return previous
+        if sys.platform == "win32":
+            import ctypes
+            if core is None:
+                core = (os.cpu_count() or 1) - 1
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadAffinityMask.restype = ctypes.c_size_t
+            kernel32.SetThreadAffinityMask.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+            return kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), 1 << core) or None
+    except OSError:
+        pass
+    return None
+
+def _restore_thread_affinity(previous):
+    # Undo _pin_current_thread on the same thread.
+    if previous is None:
+        return
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, previous)
+        elif sys.platform == "win32":
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), previous)
+    except OSError:
+        pass
+
 # The main Emulator class that ties everything together
 class N64Emulator:
     def __init__(self):
@@ -164,44 +683,97 @@ class N64Emulator:
         self.input = InputManager(num_controllers=4)
         self.running = False
         self.paused = False
+        # Set while running; the emulation loop blocks on it when paused instead of spinning.
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._thread = None
+        self._rom_mm = None  # read-only mapping backing the loaded ROM
+        self._state_staging = None  # reused decompression buffer for load_state
+        # Host core for the emulation thread: None picks one automatically, False disables pinning.
+        self.pin_to_core = None
     def load_rom(self, filepath: str):
         # Load the ROM file into memory and reset the system.
+        # Map the file read-only instead of reading it: pages are faulted in on demand
+        # and the .z64 case is served straight from the mapping without a copy.
         with open(filepath, 'rb') as f:
-            data = f.read()
-        data = self._ensure_big_endian(data)
+            if os.fstat(f.fileno()).st_size:
+                self._rom_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._rom_mm = None  # empty files cannot be mapped; load an empty cartridge
+        data = self._ensure_big_endian(self._rom_mm if self._rom_mm is not None else b'')
         self.memory.load_cartridge(data)
+        self.cpu.flush_block_cache()
         # (Extract game title or other metadata if needed here)
-    def _ensure_big_endian(self, data: bytes) -> bytes:
+    def _ensure_big_endian(self, data) -> np.ndarray:
         # Detect format by ROM header and convert to big-endian (.z64) if needed.
-        # For brevity, assume data is already .z64 or convert accordingly.
-        return data  # (In real code, implement byteswapping for .v64/.n64)
+        # Returns the ROM as a '>u4' word array; swaps are single vectorized NumPy ops.
+        words = len(data) // 4
+        magic = bytes(data[:4])
+        if magic == ROM_MAGIC_V64:
+            # .v64: byte-swapped halfwords
+            return np.frombuffer(data, dtype='>u2', count=words * 2).byteswap().view('>u4')
+        if magic == ROM_MAGIC_N64:
+            # .n64: little-endian words
+            return np.frombuffer(data, dtype='<u4', count=words).byteswap().view('>u4')
+        # .z64 (or unknown header): already big-endian, view the buffer as-is
+        return np.frombuffer(data, dtype='>u4', count=words)
+    def start_thread(self) -> threading.Thread:
+        # Run the emulation loop on a dedicated (daemon) thread and return it. running and
+        # the resume event are armed here, before the thread exists, so a stop() or pause()
+        # issued right after this returns is never overwritten by the new thread.
+        self.running = True
+        self.resume()
+        self._thread = threading.Thread(target=self._run_loop, name="n64-emulation", daemon=True)
+        self._thread.start()
+        return self._thread
     def start(self):
-        """Start the emulation loop. This would typically run in a separate thread."""
+        """Start the emulation loop. This would typically run in a separate thread (see start_thread)."""
         self.running = True
-        self.paused = False
-        # Main emulation loop
-        while self.running:
-            if self.paused:
-                continue  # if paused, just loop without advancing (or use condition variable)
-            # Emulate a small step (e.g., a number of CPU cycles or a single instruction per loop for simplicity)
-            self.cpu.execute_next_instruction()
-            # After each instruction, check and handle any interrupts (not shown here).
-            # Also process a piece of RSP task or RDP command if needed:
-            self.rsp.process_tasks()
-            self.rdp.render_if_ready()
-            # Poll inputs and update controller state
-            self.input.poll_inputs()
-            # Update audio (generate sound for this frame or time slice)
-            self.audio.update_audio()
-            # (In a real emulator, we'd synchronize these to actual time/frames)
-        # End of loop (when running is set to False)
+        self.resume()
+        self._run_loop()
+    def _run_loop(self):
+        # Keep the fetch/decode loop on one host core so its caches stay warm; the
+        # calling thread's original affinity is restored when the loop exits.
+        previous_affinity = None
+        if self.pin_to_core is not False:
+            previous_affinity = _pin_current_thread(self.pin_to_core)
+        try:
+            # Bind the per-batch calls once rather than resolving attributes every iteration.
+            wait_resumed = self._resume_event.wait
+            cpu_run = self.cpu.run
+            process_tasks = self.rsp.process_tasks
+            render_if_ready = self.rdp.render_if_ready
+            poll_inputs = self.input.poll_inputs
+            update_audio = self.audio.update_audio
+            # Main emulation loop
+            while self.running:
+                wait_resumed()  # blocks (without burning CPU) while paused
+                if not self.running:
+                    break  # stopped while paused
+                # Emulate a batch of CPU instructions, then service the rest of the system.
+                cpu_run(STEPS_PER_BATCH)
+                # After each batch, check and handle any interrupts (not shown here).
+                # Also process a piece of RSP task or RDP command if needed:
+                process_tasks()
+                render_if_ready()
+                # Poll inputs and update controller state
+                poll_inputs()
+                # Update audio (generate sound for this frame or time slice)
+                update_audio()
+                # (In a real emulator, we'd synchronize these to actual time/frames)
+            # End of loop (when running is set to False)
+        finally:
+            _restore_thread_affinity(previous_affinity)
     def pause(self):
         self.paused = True
+        self._resume_event.clear()
     def resume(self):
         self.paused = False
+        self._resume_event.set()
     def stop(self):
-        # Stop the emulation loop
+        # Stop the emulation loop (waking it if it is paused)
         self.running = False
+        self._resume_event.set()
     def reset(self):
         # Reset all components to initial state
         self.cpu.reset()
@@ -211,30 +783,57 @@ class N64Emulator:
         # Note: memory and controllers might not be fully reset to preserve loaded ROM and connected controllers
         # Could also reset memory (except ROM) if needed: self.memory.reset()
     def save_state(self, slot_name: str):
-        # Gather state from all components
-        state = {
+        # Layout (zstd-compressed): header, pickled small component state, then raw
+        # RDRAM and framebuffer bytes so the large buffers skip pickle entirely.
+        import pickle
+        import zstandard as zstd
+        meta = pickle.dumps({
             "cpu": self.cpu.get_state(),
             "rsp": self.rsp.get_state(),
-            "rdp": self.rdp.get_state(),
             "audio": self.audio.get_state(),
-            "memory": bytes(self.memory.ram),         # copy of RAM
             "controllers": self.input.get_state()
-        }
-        # Save state to file (using pickle or JSON for simplicity)
-        import pickle
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        ram = self.memory.ram
+        fb = self.rdp.framebuffer
+        header = STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(meta), len(ram), len(fb))
+        # Stream each section into the compressor; RDRAM and the framebuffer are handed
+        # over as memoryviews so they are never copied on the way to disk.
+        cctx = zstd.ZstdCompressor(level=3, threads=-1)
         with open(f"{slot_name}.state", "wb") as f:
-            pickle.dump(state, f)
+            with cctx.stream_writer(f) as writer:
+                writer.write(header)
+                writer.write(meta)
+                writer.write(memoryview(ram))
+                writer.write(memoryview(fb))
     def load_state(self, slot_name: str):
         import pickle
+        import zstandard as zstd
         with open(f"{slot_name}.state", "rb") as f:
-            state = pickle.load(f)
-        # Restore each component's state
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with zstd.ZstdDecompressor().stream_reader(mm) as reader:
+                    header = bytearray(STATE_HEADER.size)
+                    _readinto_exact(reader, memoryview(header))
+                    magic, version, meta_len, ram_len, fb_len = STATE_HEADER.unpack(header)
+                    if magic != STATE_MAGIC or version != STATE_VERSION:
+                        raise ValueError(f"{slot_name}.state is not a version {STATE_VERSION} save state")
+                    if ram_len != len(self.memory.ram) or fb_len != len(self.rdp.framebuffer):
+                        raise ValueError(f"{slot_name}.state was saved with a different memory layout")
+                    meta = bytearray(meta_len)
+                    _readinto_exact(reader, memoryview(meta))
+                    state = pickle.loads(meta)
+                    # Stage RDRAM and the framebuffer in a reusable buffer so a truncated or
+                    # corrupt file fails before any live state has been touched.
+                    if self._state_staging is None or len(self._state_staging) != ram_len + fb_len:
+                        self._state_staging = bytearray(ram_len + fb_len)
+                    staging = memoryview(self._state_staging)
+                    _readinto_exact(reader, staging)
+        # Every section was read: restore each component's state
         self.cpu.set_state(state["cpu"])
         self.rsp.set_state(state["rsp"])
-        self.rdp.set_state(state["rdp"])
         self.audio.set_state(state["audio"])
-        self.memory.ram[:] = state["memory"]  # restore RAM contents
         self.input.set_state(state["controllers"])
+        self.memory.ram[:] = staging[:ram_len]  # restore RAM contents
+        self.rdp.framebuffer[:] = staging[ram_len:]
     def apply_cheat(self, address: int, value: int):
         # Simple cheat apply: directly write a value to a RAM address (assuming address is in RDRAM).
         self.memory.write32(address, value)
@@ -0,0 +1,9 @@
+# Builds the optional Cython CPU kernel used when Numba is not installed:
+#   python setup.py build_ext --inplace
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="emua25m1port",
+    ext_modules=cythonize("_vr4300_kernel.pyx", language_level=3),
+)